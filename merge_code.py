@@ -1,4 +1,9 @@
+import io
+import mmap
 import os
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from itertools import islice
 
 IGNORE_DIRS = {
     '.git', 'node_modules', 'venv', '__pycache__', '.upm', 'dist', 'build', 
@@ -11,52 +16,92 @@ IGNORE_FILES = {
 }
 SOURCE_DIRS = {'client', 'server', 'shared', 'src'}
 INCLUDE_EXTS = {'.py', '.js', '.ts', '.tsx', '.jsx', '.css', '.md', '.sql'}
+ROOT_FILES = ['replit.md', 'design_guidelines.md', 'drizzle.config.ts', 'tailwind.config.ts', 'vite.config.ts']
+
+def iter_files(root):
+    """os.scandir ile dizini gezer; DirEntry tip bilgisini onbellekten kullanir"""
+    subdirs = []
+    try:
+        with os.scandir(root) as it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    if entry.name not in IGNORE_DIRS:
+                        subdirs.append(entry.path)
+                # os.walk gibi: sembolik bagli dosyalar dahil, bagli dizinlere inilmez
+                elif entry.is_file():
+                    if entry.name in IGNORE_FILES:
+                        continue
+                    if os.path.splitext(entry.name)[1] in INCLUDE_EXTS:
+                        yield entry.path
+    except OSError as e:
+        # os.walk gibi okunamayan/silinen dizini atla
+        print(f"Hata okunamadi: {root} -> {e}")
+    
+    for subdir in subdirs:
+        yield from iter_files(subdir)
+
+def _read_bytes(file_path):
+    """Dosyayi salt-okunur mmap olarak acar; bos dosyalar icin b'' doner"""
+    try:
+        fd = os.open(file_path, os.O_RDONLY)
+        try:
+            size = os.fstat(fd).st_size
+            if size == 0:
+                return b''
+            mm = mmap.mmap(fd, size, access=mmap.ACCESS_READ)
+        finally:
+            os.close(fd)
+        if hasattr(mmap, 'MADV_SEQUENTIAL'):
+            mm.madvise(mmap.MADV_SEQUENTIAL)
+        return mm
+    except Exception as e:
+        print(f"Hata okunamadi: {file_path} -> {e}")
+        return None
 
 def merge_codebase(output_file='full_codebase.txt'):
     total_chars = 0
     file_count = 0
+    buf = io.BytesIO()
+    
+    buf.write("# Merf.ai - Codebase Dump\n".encode('utf-8'))
+    buf.write("# Kaynak kod dosyalari\n\n".encode('utf-8'))
     
-    with open(output_file, 'w', encoding='utf-8') as outfile:
-        outfile.write("# Merf.ai - Codebase Dump\n")
-        outfile.write("# Kaynak kod dosyalari\n\n")
+    paths = []
+    for source_dir in SOURCE_DIRS:
+        if not os.path.exists(source_dir):
+            continue
+        paths.extend(iter_files(source_dir))
+    
+    for root_file in ROOT_FILES:
+        if os.path.exists(root_file):
+            paths.append(root_file)
+    
+    # Okumalar bagimsiz; paralel oku, cikti sirasini koru.
+    # Acik mmap sayisini sinirlamak icin kayan pencere kullan.
+    workers = min(32, (os.cpu_count() or 1) * 4)
+    with ThreadPoolExecutor(max_workers=workers) as ex:
+        remaining = iter(paths)
+        pending = deque((p, ex.submit(_read_bytes, p)) for p in islice(remaining, workers * 4))
         
-        for source_dir in SOURCE_DIRS:
-            if not os.path.exists(source_dir):
+        while pending:
+            file_path, fut = pending.popleft()
+            for p in islice(remaining, 1):
+                pending.append((p, ex.submit(_read_bytes, p)))
+            
+            content = fut.result()
+            if content is None:
                 continue
-                
-            for root, dirs, files in os.walk(source_dir):
-                dirs[:] = [d for d in dirs if d not in IGNORE_DIRS]
-                
-                for file in files:
-                    if file in IGNORE_FILES:
-                        continue
-                    
-                    _, ext = os.path.splitext(file)
-                    if ext in INCLUDE_EXTS:
-                        file_path = os.path.join(root, file)
-                        try:
-                            with open(file_path, 'r', encoding='utf-8') as infile:
-                                content = infile.read()
-                                outfile.write(f"\n\n--- FILE START: {file_path} ---\n")
-                                outfile.write(content)
-                                outfile.write(f"\n--- FILE END: {file_path} ---\n")
-                                total_chars += len(content)
-                                file_count += 1
-                        except Exception as e:
-                            print(f"Hata okunamadi: {file_path} -> {e}")
-        
-        for root_file in ['replit.md', 'design_guidelines.md', 'drizzle.config.ts', 'tailwind.config.ts', 'vite.config.ts']:
-            if os.path.exists(root_file):
-                try:
-                    with open(root_file, 'r', encoding='utf-8') as infile:
-                        content = infile.read()
-                        outfile.write(f"\n\n--- FILE START: {root_file} ---\n")
-                        outfile.write(content)
-                        outfile.write(f"\n--- FILE END: {root_file} ---\n")
-                        total_chars += len(content)
-                        file_count += 1
-                except Exception as e:
-                    print(f"Hata okunamadi: {root_file} -> {e}")
+            buf.write(f"\n\n--- FILE START: {file_path} ---\n".encode('utf-8'))
+            buf.write(content)
+            buf.write(f"\n--- FILE END: {file_path} ---\n".encode('utf-8'))
+            total_chars += len(content)
+            file_count += 1
+            if isinstance(content, mmap.mmap):
+                content.close()
+    
+    # Tek seferde yaz: dosya basina encode/flush maliyetinden kacin
+    with open(output_file, 'wb') as outfile:
+        outfile.write(buf.getbuffer())
 
     estimated_tokens = total_chars // 4
     print(f"\nIslem tamam!")
@@ -0,0 +1,14 @@
+"""
+Gunicorn hooks for the SAM microservice.
+
+Weights may be loaded in the master (--preload), but anything that touches
+CUDA -- device flags, torch.compile, warmup -- has to happen after fork.
+"""
+
+
+def post_worker_init(worker):
+    import sam_service
+    
+    # Without preloaded weights, models still load lazily on first request
+    if sam_service.model_loaded:
+        sam_service.prepare_models()
@@ -10,45 +10,271 @@ import os
 import sys
 import json
 import base64
+import hashlib
 import logging
+import tempfile
+import threading
 from typing import Optional, List, Tuple
 
+# Probe CUDA through NVML so torch.cuda.is_available() does not initialize
+# CUDA in a gunicorn master that forks workers afterwards
+os.environ.setdefault('PYTORCH_NVML_BASED_CUDA_CHECK', '1')
+
 # Setup logging
 logging.basicConfig(level=logging.INFO, format='[SAM] %(asctime)s - %(message)s')
 logger = logging.getLogger(__name__)
 
 try:
-    from flask import Flask, request, jsonify, send_file
+    from flask import Flask, Response, request, send_file
     from PIL import Image
     import numpy as np
+    import orjson
+    from cachetools import LRUCache
 except ImportError as e:
     logger.error(f"Missing dependency: {e}")
-    logger.error("Install with: pip install flask pillow numpy")
+    logger.error("Install with: pip install flask pillow numpy orjson cachetools")
     sys.exit(1)
 
+try:
+    import cv2
+except ImportError:
+    cv2 = None
+
+# libjpeg-turbo SIMD encoder; falls back to PIL when the library is missing
+try:
+    from turbojpeg import TurboJPEG, TJPF_BGR, TJSAMP_420
+    _tj = TurboJPEG()
+except Exception:
+    _tj = None
+
 # Lazy load heavy dependencies
 sam_model = None
 fastsam_model = None
 model_loaded = False
+models_prepared = False
+use_half = False
+_prepare_lock = threading.Lock()
+# CUDA-graph trees are per thread; only single-threaded serving (gunicorn
+# sync workers, set by wsgi.py) can replay graphs recorded at warmup
+single_threaded_serving = False
+_load_lock = threading.Lock()
+
+FASTSAM_INT8_PATH = 'FastSAM-s.int8.onnx'
+
+# Repeat-upload caches keyed by SHA-1 of the image bytes
+# Decoded images are bounded by RGB bytes, not count: one 12 MP upload is ~36 MB
+decode_cache = LRUCache(
+    maxsize=int(os.environ.get('SAM_DECODE_CACHE_MB', 128)) * 1024 * 1024,
+    getsizeof=lambda im: im.width * im.height * 3
+)
+result_cache = LRUCache(maxsize=int(os.environ.get('SAM_RESULT_CACHE_SIZE', 64)))
+_cache_lock = threading.Lock()
 
 app = Flask(__name__)
 
-def load_models():
-    """Lazy load SAM models to avoid startup delays"""
-    global sam_model, fastsam_model, model_loaded
+
+def encode_jpeg(bgr_array: np.ndarray, quality: int = 85) -> bytes:
+    """Encode a BGR image to JPEG, via TurboJPEG when available"""
+    if _tj is not None:
+        # TurboJPEG reads BGR directly: no channel swap or PIL copy
+        return _tj.encode(
+            bgr_array, quality=quality, pixel_format=TJPF_BGR, jpeg_subsample=TJSAMP_420
+        )
     
-    if model_loaded:
-        return True
+    if cv2 is not None:
+        rgb_array = cv2.cvtColor(bgr_array, cv2.COLOR_BGR2RGB)
+    else:
+        rgb_array = np.ascontiguousarray(bgr_array[..., ::-1])
+    
+    # Save to BytesIO (Zero-Disk I/O)
+    img_buffer = io.BytesIO()
+    Image.fromarray(rgb_array).save(img_buffer, format='JPEG', quality=quality)
+    with img_buffer.getbuffer() as view:
+        return bytes(view)
+
+
+def json_response(obj, status: int = 200) -> Response:
+    """Serialize a JSON response with orjson instead of Flask's stdlib encoder"""
+    return Response(
+        orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY),
+        status=status,
+        mimetype='application/json'
+    )
+
+
+def run_dummy_inference(torch, model, imgsz: int = 640) -> None:
+    """One forward pass on a blank image; MobileSAM gets a full-frame box prompt"""
+    dummy = Image.new('RGB', (imgsz, imgsz))
+    prompts = {"bboxes": [[0, 0, imgsz, imgsz]]} if model is sam_model else {}
+    
+    with torch.inference_mode():
+        model(dummy, retina_masks=False, imgsz=imgsz, half=use_half, verbose=False, **prompts)
+
+
+def compile_models(torch) -> None:
+    """
+    JIT-compile MobileSAM's image encoder, which its predictor calls directly.
+    
+    torch.compile is lazy, so a dummy forward forces compilation here rather
+    than on the first request; any failure restores the eager encoder.
+    FastSAM is left eager: ultralytics' AutoBackend calls fuse(), which
+    unwraps a compiled module back to the original.
+    
+    mode='reduce-overhead' (CUDA graphs) is used only on GPU under
+    single-threaded serving: inductor keeps graph trees per thread, so the
+    threaded Flask server (a new thread per request) would never replay them.
+    """
+    if not hasattr(torch, 'compile'):
+        logger.info("torch.compile unavailable, using eager models")
+        return
+    
+    eager_encoder = sam_model.model.image_encoder
+    # CUDA graphs need a GPU and one serving thread; otherwise use the default mode
+    use_graphs = torch.cuda.is_available() and single_threaded_serving
+    mode = 'reduce-overhead' if use_graphs else 'default'
+    
+    try:
+        sam_model.model.image_encoder = torch.compile(eager_encoder, mode=mode)
+        run_dummy_inference(torch, sam_model)
+        logger.info(f"MobileSAM image encoder compiled (mode={mode})")
+    except Exception as e:
+        sam_model.model.image_encoder = eager_encoder
+        logger.warning(f"torch.compile failed, using eager models: {e}")
+
+
+def warmup_models(torch, imgsz: int = 640) -> None:
+    """
+    Run each model once at the default imgsz so the first request does not
+    pay CUDA context setup, cuDNN autotuning or ultralytics predictor setup.
+    
+    CUDA graphs are recorded here only with SAM_TORCH_COMPILE=1 under
+    gunicorn sync workers (see compile_models); FastSAM is never compiled.
+    """
+    try:
+        run_dummy_inference(torch, sam_model, imgsz)
+        run_dummy_inference(torch, fastsam_model, imgsz)
+        torch.cuda.synchronize()
+        logger.info(f"Models warmed up at imgsz={imgsz}")
+    except Exception as e:
+        logger.warning(f"Warmup failed, first request will pay setup cost: {e}")
+
+
+def quantize_mobilesam_int8(torch) -> None:
+    """Dynamic int8 quantization of the TinyViT encoder's Linear layers (CPU only)"""
+    sam_model.model.image_encoder = torch.ao.quantization.quantize_dynamic(
+        sam_model.model.image_encoder, {torch.nn.Linear}, dtype=torch.qint8
+    )
+
+
+def export_fastsam_int8() -> str:
+    """
+    Offline step: export FastSAM to ONNX and quantize it to int8.
+    
+    Run once with `python script/sam_service.py --export-int8` from the repo
+    root; the request path only loads an existing artifact.
+    """
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+    from ultralytics import FastSAM
+    
+    logger.info("Exporting FastSAM to ONNX...")
+    onnx_path = FastSAM('FastSAM-s.pt').export(format='onnx', dynamic=True, simplify=True)
+    
+    # Quantize into a private temp file beside the target, then rename atomically
+    target_dir = os.path.dirname(os.path.abspath(FASTSAM_INT8_PATH))
+    fd, tmp_path = tempfile.mkstemp(suffix='.onnx', dir=target_dir)
+    os.close(fd)
+    try:
+        # ConvInteger kernels take uint8 weights
+        quantize_dynamic(onnx_path, tmp_path, weight_type=QuantType.QUInt8)
+        os.replace(tmp_path, FASTSAM_INT8_PATH)
+    except BaseException:
+        os.unlink(tmp_path)
+        raise
+    
+    logger.info(f"Wrote {FASTSAM_INT8_PATH}")
+    return FASTSAM_INT8_PATH
+
+
+def prepare_models() -> None:
+    """
+    Per-process setup that may touch CUDA: device flags, torch.compile and
+    warmup. Must run in the process that serves requests, never in a
+    gunicorn master before fork -- a forked child cannot re-initialize CUDA.
+    """
+    global models_prepared, use_half
+    
+    with _prepare_lock:
+        if models_prepared:
+            return
+        
+        import torch
+        
+        # Fixed imgsz input: let cuDNN pick the fastest conv algorithms
+        if torch.cuda.is_available():
+            torch.backends.cudnn.benchmark = True
+            # fp16 halves weight/activation bandwidth on GPU
+            use_half = os.environ.get('SAM_HALF', '1') == '1'
+        
+        # Opt-in: inductor needs a C++ toolchain, which slim images often lack
+        if os.environ.get('SAM_TORCH_COMPILE', '0') == '1':
+            compile_models(torch)
+        
+        if torch.cuda.is_available() and os.environ.get('SAM_WARMUP', '1') == '1':
+            warmup_models(torch)
+        
+        models_prepared = True
+
+
+def load_models(prepare: bool = True):
+    """
+    Lazy load SAM models to avoid startup delays.
+    
+    Loading only reads weights on CPU and is safe before fork; pass
+    prepare=False there and call prepare_models() in each worker.
+    """
+    with _load_lock:
+        if not model_loaded and not _load_weights():
+            return False
+    
+    if prepare:
+        prepare_models()
+    return True
+
+
+def _load_weights() -> bool:
+    """Read model weights; callers hold _load_lock"""
+    global sam_model, fastsam_model, model_loaded
     
     try:
+        import torch
         from ultralytics import SAM, FastSAM
         
+        # Opt-in int8 on CPU hosts; accuracy/latency must be checked per deployment
+        cpu_int8 = not torch.cuda.is_available() and os.environ.get('SAM_CPU_INT8', '0') == '1'
+        
         logger.info("Loading MobileSAM model (~40MB)...")
         sam_model = SAM('mobile_sam.pt')
+        if cpu_int8:
+            try:
+                quantize_mobilesam_int8(torch)
+                logger.info("MobileSAM image encoder quantized to int8")
+            except Exception as e:
+                logger.warning(f"MobileSAM int8 quantization failed, using fp32: {e}")
         logger.info("MobileSAM loaded successfully!")
         
         logger.info("Loading FastSAM model (~24MB)...")
-        fastsam_model = FastSAM('FastSAM-s.pt')
+        fastsam_model = None
+        if cpu_int8:
+            if os.path.exists(FASTSAM_INT8_PATH):
+                fastsam_model = FastSAM(FASTSAM_INT8_PATH)
+                logger.info("FastSAM running int8 on ONNX Runtime")
+            else:
+                logger.warning(
+                    f"{FASTSAM_INT8_PATH} missing, using fp32; "
+                    "run `python script/sam_service.py --export-int8` to create it"
+                )
+        if fastsam_model is None:
+            fastsam_model = FastSAM('FastSAM-s.pt')
         logger.info("FastSAM loaded successfully!")
         
         model_loaded = True
@@ -92,7 +318,7 @@ def process_image_with_sam(
             return None, {"error": f"Model {model_type} not available"}
         
         # Prepare prompt arguments
-        kwargs = {"retina_masks": False, "imgsz": imgsz}
+        kwargs = {"retina_masks": False, "imgsz": imgsz, "half": use_half}
         
         if points is not None and len(points) > 0:
             kwargs["points"] = points
@@ -102,9 +328,12 @@ def process_image_with_sam(
         if bboxes is not None and len(bboxes) > 0:
             kwargs["bboxes"] = bboxes
         
-        # Run inference
+        # Run inference (no autograd bookkeeping)
+        import torch
+        
         logger.info(f"Running {model_type} inference with params: {kwargs}")
-        results = model(image, **kwargs)
+        with torch.inference_mode():
+            results = model(image, **kwargs)
         
         if not results or len(results) == 0:
             return None, {"error": "No results from model"}
@@ -119,31 +348,85 @@ def process_image_with_sam(
         }
         
         if result.masks is not None:
-            masks_data = result.masks.data.cpu().numpy()
-            metadata["num_masks"] = len(masks_data)
-            metadata["mask_areas"] = [int(np.sum(m)) for m in masks_data]
-        
-        # Generate visualization (BGR -> RGB)
-        res_array = result.plot()
-        res_image = Image.fromarray(res_array[..., ::-1])
+            # Reduce on the model's device; only one int per mask crosses to host
+            masks = result.masks.data
+            metadata["num_masks"] = int(masks.shape[0])
+            # Masks are binary: count_nonzero yields int64 areas in one kernel, no float sum + cast
+            metadata["mask_areas"] = torch.count_nonzero(masks.reshape(masks.shape[0], -1), dim=1).tolist()
         
-        # Save to BytesIO (Zero-Disk I/O)
-        img_buffer = io.BytesIO()
-        res_image.save(img_buffer, format='JPEG', quality=85)
-        img_buffer.seek(0)
+        # Generate visualization (BGR)
+        result_bytes = encode_jpeg(result.plot())
         
         logger.info(f"Segmentation complete: {metadata['num_masks']} masks found")
-        return img_buffer.getvalue(), metadata
+        return result_bytes, metadata
         
     except Exception as e:
         logger.error(f"Processing error: {e}")
         return None, {"error": str(e)}
 
 
+def hash_upload(stream) -> bytes:
+    """SHA-1 of an upload stream, read in chunks; rewinds the stream afterwards"""
+    digest = hashlib.sha1()
+    for chunk in iter(lambda: stream.read(1 << 16), b''):
+        digest.update(chunk)
+    stream.seek(0)
+    return digest.digest()
+
+
+def segment_upload(
+    stream,
+    model_type: str = "mobilesam",
+    points: Optional[List[List[int]]] = None,
+    labels: Optional[List[int]] = None,
+    bboxes: Optional[List[List[int]]] = None,
+    imgsz: int = 640
+) -> Tuple[Optional[bytes], dict]:
+    """
+    Segment an uploaded image, reusing earlier work for repeat uploads.
+    
+    Identical image + prompts return the cached result without inference;
+    a known image with new prompts skips only the PIL decode.
+    """
+    image_key = hash_upload(stream)
+    result_key = (image_key, model_type, imgsz, orjson.dumps([points, labels, bboxes]))
+    
+    with _cache_lock:
+        cached = result_cache.get(result_key)
+    if cached is not None:
+        logger.info("Result cache hit")
+        return cached[0], dict(cached[1])
+    
+    with _cache_lock:
+        image = decode_cache.get(image_key)
+    if image is None:
+        # Decode straight from the upload stream (Zero-Disk I/O)
+        image = Image.open(stream).convert('RGB')
+        # LRUCache rejects single items larger than the whole budget
+        if decode_cache.getsizeof(image) <= decode_cache.maxsize:
+            with _cache_lock:
+                decode_cache[image_key] = image
+    
+    result_bytes, metadata = process_image_with_sam(
+        image=image,
+        model_type=model_type,
+        points=points,
+        labels=labels,
+        bboxes=bboxes,
+        imgsz=imgsz
+    )
+    
+    if result_bytes is not None:
+        with _cache_lock:
+            result_cache[result_key] = (result_bytes, dict(metadata))
+    
+    return result_bytes, metadata
+
+
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return jsonify({
+    return json_response({
         "status": "healthy",
         "models_loaded": model_loaded,
         "service": "SAM Microservice"
@@ -154,7 +437,7 @@ def health_check():
 def load_models_endpoint():
     """Explicitly load models"""
     success = load_models()
-    return jsonify({
+    return json_response({
         "success": success,
         "models_loaded": model_loaded
     })
@@ -179,15 +462,11 @@ def segment_image():
     try:
         # Validate file
         if 'file' not in request.files:
-            return jsonify({"error": "No file provided"}), 400
+            return json_response({"error": "No file provided"}, 400)
         
         file = request.files['file']
         if file.filename == '':
-            return jsonify({"error": "Empty filename"}), 400
-        
-        # Read image from memory (Zero-Disk I/O)
-        img_bytes = file.read()
-        image = Image.open(io.BytesIO(img_bytes)).convert('RGB')
+            return json_response({"error": "Empty filename"}, 400)
         
         # Parse parameters
         model_type = request.form.get('model', 'mobilesam')
@@ -219,9 +498,9 @@ def segment_image():
             except json.JSONDecodeError:
                 pass
         
-        # Process image
-        result_bytes, metadata = process_image_with_sam(
-            image=image,
+        # Process image (cached per upload hash + prompts)
+        result_bytes, metadata = segment_upload(
+            stream=file.stream,
             model_type=model_type,
             points=points,
             labels=labels,
@@ -230,7 +509,7 @@ def segment_image():
         )
         
         if result_bytes is None:
-            return jsonify(metadata), 500
+            return json_response(metadata, 500)
         
         # Return image with metadata in headers
         response = send_file(
@@ -242,14 +521,14 @@ def segment_image():
         response.headers['X-SAM-Model'] = metadata.get('model', 'unknown')
         response.headers['X-SAM-Masks'] = str(metadata.get('num_masks', 0))
         response.headers['X-SAM-Metadata'] = base64.b64encode(
-            json.dumps(metadata).encode()
+            orjson.dumps(metadata, option=orjson.OPT_SERIALIZE_NUMPY)
         ).decode()
         
         return response
         
     except Exception as e:
         logger.error(f"Segment endpoint error: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, 500)
 
 
 @app.route('/segment-json', methods=['POST'])
@@ -260,14 +539,11 @@ def segment_image_json():
     """
     try:
         if 'file' not in request.files:
-            return jsonify({"error": "No file provided"}), 400
+            return json_response({"error": "No file provided"}, 400)
         
         file = request.files['file']
         if file.filename == '':
-            return jsonify({"error": "Empty filename"}), 400
-        
-        img_bytes = file.read()
-        image = Image.open(io.BytesIO(img_bytes)).convert('RGB')
+            return json_response({"error": "Empty filename"}, 400)
         
         model_type = request.form.get('model', 'mobilesam')
         if model_type not in ['mobilesam', 'fastsam']:
@@ -297,8 +573,8 @@ def segment_image_json():
             except json.JSONDecodeError:
                 pass
         
-        result_bytes, metadata = process_image_with_sam(
-            image=image,
+        result_bytes, metadata = segment_upload(
+            stream=file.stream,
             model_type=model_type,
             points=points,
             labels=labels,
@@ -307,12 +583,12 @@ def segment_image_json():
         )
         
         if result_bytes is None:
-            return jsonify({"success": False, **metadata}), 500
+            return json_response({"success": False, **metadata}, 500)
         
         # Encode image as base64
         image_base64 = base64.b64encode(result_bytes).decode('utf-8')
         
-        return jsonify({
+        return json_response({
             "success": True,
             "image": f"data:image/jpeg;base64,{image_base64}",
             "metadata": metadata
@@ -320,13 +596,67 @@ def segment_image_json():
         
     except Exception as e:
         logger.error(f"Segment-JSON endpoint error: {e}")
-        return jsonify({"success": False, "error": str(e)}), 500
+        return json_response({"success": False, "error": str(e)}, 500)
+
+
+def run_gunicorn(port: int, workers: int) -> None:
+    """Replace this process with a gunicorn master serving wsgi:app"""
+    import shutil
+    
+    gunicorn = shutil.which('gunicorn')
+    if gunicorn is None:
+        logger.warning("gunicorn not installed, falling back to threaded Flask server")
+        return
+    
+    script_dir = os.path.dirname(os.path.abspath(__file__))
+    args = [gunicorn, '--workers', str(workers), '--worker-class', 'sync']
+    
+    # --preload loads weights before the port is bound. Only do that when they
+    # are already on disk; a first-run download would outlast the supervisor's
+    # readiness check, so bind first and let each worker load lazily instead.
+    if all(os.path.exists(w) for w in ('mobile_sam.pt', 'FastSAM-s.pt')):
+        args.append('--preload')
+    else:
+        logger.info("Model weights not on disk yet, workers will load lazily")
+        os.environ['SAM_PRELOAD_WEIGHTS'] = '0'
+    
+    logger.info(f"Starting gunicorn with {workers} workers...")
+    os.execv(gunicorn, args + [
+        '--timeout', '120',
+        '--config', os.path.join(script_dir, 'gunicorn.conf.py'),
+        '--bind', f'0.0.0.0:{port}',
+        # Import wsgi from this directory but keep the caller's cwd, where the
+        # relative weight paths (mobile_sam.pt, FastSAM-s.pt) resolve
+        '--pythonpath', script_dir,
+        'wsgi:app'
+    ])
 
 
 if __name__ == '__main__':
+    import argparse
+    
+    parser = argparse.ArgumentParser(description="SAM Microservice")
+    parser.add_argument(
+        '--workers', type=int, default=int(os.environ.get('SAM_WORKERS', 1)),
+        help="Worker processes; >1 serves via gunicorn (default: $SAM_WORKERS or 1)"
+    )
+    parser.add_argument(
+        '--export-int8', action='store_true',
+        help=f"Export and quantize FastSAM to {FASTSAM_INT8_PATH}, then exit"
+    )
+    args = parser.parse_args()
+    
+    if args.export_int8:
+        export_fastsam_int8()
+        sys.exit(0)
+    
     port = int(os.environ.get('SAM_PORT', 8081))
     logger.info(f"Starting SAM Microservice on port {port}...")
     
+    # Process-based workers avoid GIL contention in the inference wrappers
+    if args.workers > 1:
+        run_gunicorn(port, args.workers)
+    
     # Pre-load models for faster first request
     if os.environ.get('PRELOAD_MODELS', '0') == '1':
         logger.info("Pre-loading models...")
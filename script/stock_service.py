@@ -2,26 +2,77 @@
 """
 Merf Stock Engine - Financial Analysis Microservice
 FastAPI-based stock analysis using Yahoo Finance API directly.
-Pure Python implementation without numpy C extensions.
+Technical indicators are computed with NumPy (Numba-compiled when installed).
 """
 
 import os
 import json
-import requests
+import time
+import asyncio
+import httpx
+import numpy as np
+from collections import OrderedDict
+from contextlib import asynccontextmanager
 from datetime import datetime, timedelta
 from fastapi import FastAPI, HTTPException, Header
 from pydantic import BaseModel
-from typing import Optional, List, Dict, Any
+from typing import Optional, List, Dict, Any, Tuple
 
 import uvicorn
 
+try:
+    from numba import njit
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+
+YAHOO_CHART_URL = "https://query1.finance.yahoo.com/v8/finance/chart/"
+YAHOO_USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
+YAHOO_MAX_CONNECTIONS = 20
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Shared connection pool: TCP/TLS handshakes are paid once, not per request
+    # pool=None: waiting for a free connection is not a request failure
+    app.state.http = httpx.AsyncClient(
+        timeout=httpx.Timeout(10, pool=None),
+        headers={"User-Agent": YAHOO_USER_AGENT},
+        limits=httpx.Limits(max_connections=YAHOO_MAX_CONNECTIONS, max_keepalive_connections=10)
+    )
+    yield
+    await app.state.http.aclose()
+
 app = FastAPI(
     title="Merf Stock Engine",
     description="Finansal analiz ve teknik gösterge mikroservisi.",
-    version="1.0.0"
+    version="1.0.0",
+    lifespan=lifespan
 )
 
 API_SECRET = os.environ.get("SERVICE_SECRET", "merf_stock_secret_123")
+MAX_BATCH_SYMBOLS = 50
+
+# Yahoo response freshness per interval (seconds)
+YAHOO_CACHE_TTL = {"1m": 15, "2m": 30, "5m": 60, "15m": 60, "30m": 60}
+YAHOO_CACHE_TTL_DEFAULT = 60
+YAHOO_CACHE_MAXSIZE = 512
+
+# Fixed-length periods; "ytd" is computed per call
+PERIOD_SECONDS = {
+    "1d": 86400,
+    "5d": 5 * 86400,
+    "1mo": 30 * 86400,
+    "3mo": 90 * 86400,
+    "6mo": 180 * 86400,
+    "1y": 365 * 86400,
+    "2y": 2 * 365 * 86400,
+    "5y": 5 * 365 * 86400,
+    "10y": 10 * 365 * 86400,
+    "max": 50 * 365 * 86400
+}
+
+# (symbol, period, interval) -> (expires_at, data), oldest first
+_yahoo_cache: "OrderedDict[Tuple[str, str, str], Tuple[float, Dict[str, Any]]]" = OrderedDict()
 
 class StockRequest(BaseModel):
     symbol: str
@@ -37,67 +88,101 @@ class StockResponse(BaseModel):
     period: str
     data_points: int
 
-def calculate_rsi(closes: List[float], window: int = 14) -> float:
-    """Calculate RSI using pure Python (Wilder's smoothing method)"""
-    if len(closes) < window + 1:
-        return 50.0
-    
-    deltas = [closes[i] - closes[i-1] for i in range(1, len(closes))]
-    
-    gains = []
-    losses = []
-    
-    for d in deltas:
-        if d > 0:
-            gains.append(d)
-            losses.append(0)
-        else:
-            gains.append(0)
-            losses.append(abs(d))
-    
-    if len(gains) < window:
-        return 50.0
-    
-    avg_gain = sum(gains[:window]) / window
-    avg_loss = sum(losses[:window]) / window
+class BatchRequest(BaseModel):
+    symbols: List[str]
+    period: str = "1mo"
+    interval: str = "1d"
+
+class BatchResponse(BaseModel):
+    results: List[StockResponse]
+    errors: Dict[str, str]
+
+def _rsi_core_numpy(gains: np.ndarray, losses: np.ndarray, window: int) -> float:
+    """Wilder smoothing in closed form: avg = avg0 * a^n + sum(x_k * (1 - a) * a^(n-1-k))"""
+    avg_gain = gains[:window].mean()
+    avg_loss = losses[:window].mean()
     
-    for i in range(window, len(gains)):
-        avg_gain = (avg_gain * (window - 1) + gains[i]) / window
-        avg_loss = (avg_loss * (window - 1) + losses[i]) / window
+    tail = len(gains) - window
+    if tail > 0:
+        decay = (window - 1) / window
+        weights = decay ** np.arange(tail - 1, -1, -1, dtype=np.float64) / window
+        avg_gain = avg_gain * decay ** tail + np.dot(gains[window:], weights)
+        avg_loss = avg_loss * decay ** tail + np.dot(losses[window:], weights)
     
     if avg_loss == 0:
         return 100.0
     
-    rs = avg_gain / avg_loss
-    rsi = 100 - (100 / (1 + rs))
+    return float(100 - (100 / (1 + avg_gain / avg_loss)))
+
+if NUMBA_AVAILABLE:
+    @njit(cache=True, fastmath=True)
+    def _rsi_core(gains: np.ndarray, losses: np.ndarray, window: int) -> float:
+        """Sequential Wilder smoothing compiled to native code"""
+        avg_gain = 0.0
+        avg_loss = 0.0
+        for i in range(window):
+            avg_gain += gains[i]
+            avg_loss += losses[i]
+        avg_gain /= window
+        avg_loss /= window
+        
+        for i in range(window, gains.shape[0]):
+            avg_gain = (avg_gain * (window - 1) + gains[i]) / window
+            avg_loss = (avg_loss * (window - 1) + losses[i]) / window
+        
+        if avg_loss == 0:
+            return 100.0
+        
+        return 100 - (100 / (1 + avg_gain / avg_loss))
+else:
+    _rsi_core = _rsi_core_numpy
+
+def calculate_rsi(closes: List[float], window: int = 14) -> float:
+    """Calculate RSI (Wilder's smoothing method), Numba-compiled when available"""
+    if len(closes) < window + 1:
+        return 50.0
+    
+    deltas = np.diff(np.asarray(closes, dtype=np.float64))
+    gains = np.where(deltas > 0, deltas, 0.0)
+    losses = np.where(deltas < 0, -deltas, 0.0)
     
-    return round(rsi, 2)
+    return round(float(_rsi_core(gains, losses, window)), 2)
 
 def get_period_seconds(period: str) -> int:
     """Convert period string to seconds"""
-    period_map = {
-        "1d": 86400,
-        "5d": 5 * 86400,
-        "1mo": 30 * 86400,
-        "3mo": 90 * 86400,
-        "6mo": 180 * 86400,
-        "1y": 365 * 86400,
-        "2y": 2 * 365 * 86400,
-        "5y": 5 * 365 * 86400,
-        "10y": 10 * 365 * 86400,
-        "ytd": int((datetime.now() - datetime(datetime.now().year, 1, 1)).total_seconds()),
-        "max": 50 * 365 * 86400
-    }
-    return period_map.get(period, 30 * 86400)
+    if period == "ytd":
+        now = datetime.now()
+        return int((now - datetime(now.year, 1, 1)).total_seconds())
+    return PERIOD_SECONDS.get(period, 30 * 86400)
 
-def fetch_yahoo_data(symbol: str, period: str = "1mo", interval: str = "1d") -> Dict[str, Any]:
+async def fetch_yahoo_data(symbol: str, period: str = "1mo", interval: str = "1d") -> Dict[str, Any]:
+    """Fetch stock data from Yahoo Finance, served from a short-lived cache when fresh"""
+    key = (symbol, period, interval)
+    now = time.monotonic()
+    
+    cached = _yahoo_cache.get(key)
+    if cached is not None and cached[0] > now:
+        _yahoo_cache.move_to_end(key)
+        return cached[1]
+    
+    data = await _fetch_yahoo_uncached(symbol, period, interval)
+    
+    ttl = YAHOO_CACHE_TTL.get(interval, YAHOO_CACHE_TTL_DEFAULT)
+    _yahoo_cache[key] = (now + ttl, data)
+    _yahoo_cache.move_to_end(key)
+    if len(_yahoo_cache) > YAHOO_CACHE_MAXSIZE:
+        _yahoo_cache.popitem(last=False)
+    
+    return data
+
+async def _fetch_yahoo_uncached(symbol: str, period: str, interval: str) -> Dict[str, Any]:
     """Fetch stock data from Yahoo Finance API directly"""
     
     period_seconds = get_period_seconds(period)
     end_time = int(datetime.now().timestamp())
     start_time = end_time - period_seconds
     
-    url = f"https://query1.finance.yahoo.com/v8/finance/chart/{symbol}"
+    url = YAHOO_CHART_URL + symbol
     params = {
         "period1": start_time,
         "period2": end_time,
@@ -106,11 +191,7 @@ def fetch_yahoo_data(symbol: str, period: str = "1mo", interval: str = "1d") ->
         "events": "div,splits"
     }
     
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36"
-    }
-    
-    response = requests.get(url, params=params, headers=headers, timeout=10)
+    response = await app.state.http.get(url, params=params)
     
     if response.status_code != 200:
         raise HTTPException(status_code=response.status_code, detail=f"Yahoo Finance API error")
@@ -148,17 +229,13 @@ def home():
 def health_check():
     return {"status": "healthy", "service": "Merf Stock Engine"}
 
-@app.post("/analyze", response_model=StockResponse)
-def analyze_stock(request: StockRequest, x_api_token: Optional[str] = Header(None)):
-    if x_api_token != API_SECRET:
-        raise HTTPException(status_code=401, detail="Yetkisiz Erişim!")
-    
-    symbol = request.symbol.upper()
+async def _analyze_one(symbol: str, period: str, interval: str) -> StockResponse:
+    symbol = symbol.upper()
     if len(symbol) <= 5 and not symbol.endswith(".IS") and "USD" not in symbol:
         symbol += ".IS"
     
     try:
-        data = fetch_yahoo_data(symbol, request.period, request.interval)
+        data = await fetch_yahoo_data(symbol, period, interval)
     except HTTPException:
         raise
     except Exception as e:
@@ -183,10 +260,50 @@ def analyze_stock(request: StockRequest, x_api_token: Optional[str] = Header(Non
         change_percent=round(float(change_pct), 2),
         rsi=rsi_val,
         recommendation=recommendation,
-        period=request.period,
+        period=period,
         data_points=len(closes)
     )
 
+@app.post("/analyze", response_model=StockResponse)
+async def analyze_stock(request: StockRequest, x_api_token: Optional[str] = Header(None)):
+    if x_api_token != API_SECRET:
+        raise HTTPException(status_code=401, detail="Yetkisiz Erişim!")
+    
+    return await _analyze_one(request.symbol, request.period, request.interval)
+
+@app.post("/analyze_batch", response_model=BatchResponse)
+async def analyze_batch(request: BatchRequest, x_api_token: Optional[str] = Header(None)):
+    """Analyze several symbols concurrently over the shared HTTP pool"""
+    if x_api_token != API_SECRET:
+        raise HTTPException(status_code=401, detail="Yetkisiz Erişim!")
+    
+    if len(request.symbols) > MAX_BATCH_SYMBOLS:
+        raise HTTPException(status_code=400, detail=f"En fazla {MAX_BATCH_SYMBOLS} sembol gönderilebilir.")
+    
+    # Keep a batch's fan-out within the connection pool
+    limit = asyncio.Semaphore(YAHOO_MAX_CONNECTIONS)
+    
+    async def analyze_limited(symbol: str) -> StockResponse:
+        async with limit:
+            return await _analyze_one(symbol, request.period, request.interval)
+    
+    outcomes = await asyncio.gather(
+        *(analyze_limited(s) for s in request.symbols),
+        return_exceptions=True
+    )
+    
+    results = []
+    errors = {}
+    for symbol, outcome in zip(request.symbols, outcomes):
+        if isinstance(outcome, HTTPException):
+            errors[symbol] = str(outcome.detail)
+        elif isinstance(outcome, Exception):
+            errors[symbol] = str(outcome)
+        else:
+            results.append(outcome)
+    
+    return BatchResponse(results=results, errors=errors)
+
 if __name__ == "__main__":
     port = int(os.environ.get("STOCK_SERVICE_PORT", 8082))
     print(f"[StockEngine] Starting on port {port}...")
@@ -0,0 +1,34 @@
+"""
+WSGI entrypoint for the SAM microservice.
+
+Run with sync workers only, from the repo root so the relative weight
+paths resolve (this is what `sam_service.py --workers N` does):
+
+    gunicorn -w 2 -k sync --preload --pythonpath script \
+        -c script/gunicorn.conf.py wsgi:app
+
+With --preload the model weights load once in the master on CPU, without
+touching CUDA, and the forked workers share those pages copy-on-write.
+The post_worker_init hook in gunicorn.conf.py then does the CUDA setup,
+compile and warmup inside each worker.
+
+This is controlled by SAM_PRELOAD_WEIGHTS (default 1), not PRELOAD_MODELS:
+the Node supervisor starts the service with PRELOAD_MODELS=0 to keep the
+single-process server lazy, which must not force one model copy per
+worker here. Set SAM_PRELOAD_WEIGHTS=0 to load lazily per worker instead;
+`sam_service.py --workers N` does so (and drops --preload) when the weight
+files are not on disk yet, so the port is bound before any download.
+"""
+
+import os
+
+import sam_service
+from sam_service import app, load_models, logger
+
+# Sync workers serve each request on the same thread, so CUDA graphs
+# recorded during warmup can be replayed (see compile_models)
+sam_service.single_threaded_serving = True
+
+if os.environ.get('SAM_PRELOAD_WEIGHTS', '1') == '1':
+    logger.info("Pre-loading model weights before fork...")
+    load_models(prepare=False)
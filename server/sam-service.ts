@@ -16,6 +16,9 @@ let pythonProcess: ChildProcess | null = null;
 let isServiceReady = false;
 let startupAttempts = 0;
 const MAX_STARTUP_ATTEMPTS = 3;
+// gunicorn (SAM_WORKERS > 1) preloads weights before binding the port
+const SAM_WORKERS = parseInt(process.env.SAM_WORKERS || '1');
+const READY_CHECK_ATTEMPTS = SAM_WORKERS > 1 ? 60 : 10;
 
 /**
  * Make HTTP request with timeout
@@ -191,7 +194,7 @@ export async function startSamService(): Promise<boolean> {
       });
 
       // Wait for service to be ready with health checks
-      checkServiceReady(10, 1000)
+      checkServiceReady(READY_CHECK_ATTEMPTS, 1000)
         .then((ready) => {
           isServiceReady = ready;
           if (ready) {